@@ -0,0 +1,49 @@
+#Probe latency benchmark
+#Usage: python bench_probe.py song1.mp3 song2.flac ... [--runs 20]
+import argparse
+import os
+import statistics
+import time
+from media import probe_audio_window, probe_audio_file, id3v2_size, AUDIO_PROBE_HEADER_BYTES, AUDIO_PROBE_MAX_HEADER_BYTES, AUDIO_PROBE_TAIL_BYTES
+
+def read_window(path):
+    # Same header/tail windows the upload endpoint reads
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(AUDIO_PROBE_HEADER_BYTES)
+        tag_size = id3v2_size(head)
+        if tag_size:
+            head += f.read(min(tag_size + AUDIO_PROBE_HEADER_BYTES, AUDIO_PROBE_MAX_HEADER_BYTES) - len(head))
+        tail = b""
+        if file_size > len(head):
+            f.seek(max(file_size - AUDIO_PROBE_TAIL_BYTES, len(head)))
+            tail = f.read(AUDIO_PROBE_TAIL_BYTES)
+    return head, file_size, tail
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    for path in args.files:
+        head, file_size, tail = read_window(path)
+        timings = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            probed = probe_audio_window(head, file_size, tail)
+            source = "window"
+            if not probed or probed["duration"] is None:
+                # Same full-file fallback the upload endpoint uses
+                with open(path, "rb") as f:
+                    probed = probe_audio_file(f)
+                source = "full file"
+            timings.append((time.perf_counter() - started) * 1000)
+        print(
+            f"{os.path.basename(path)}: {source}, read {(len(head) + len(tail)) / 1024:.0f} KiB of {file_size / 1024:.0f} KiB, "
+            f"median {statistics.median(timings):.2f} ms, max {max(timings):.2f} ms, "
+            f"duration={probed and probed['duration']} bitRate={probed and probed['bitRate']}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
-from fastapi import FastAPI , File , UploadFile , Form , BackgroundTasks , HTTPException , Query
+from fastapi import FastAPI , File , UploadFile , Form , BackgroundTasks , HTTPException , Query , Depends , Header
 from dotenv import load_dotenv
 import os
-from pydantic import BaseModel ,  EmailStr , Field
-from pymongo import MongoClient
+from pydantic import BaseModel ,  EmailStr , Field , ValidationError
+from pymongo import MongoClient , ASCENDING , DESCENDING , ReturnDocument
 from pymongo.errors import ConnectionFailure 
 import cloudinary
 import cloudinary.uploader
@@ -10,7 +10,7 @@ import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_mail import ConnectionConfig
 from fastapi_mail import FastMail, MessageSchema, MessageType
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
 import json
 import yt_dlp
@@ -18,11 +18,36 @@ import subprocess
 import io
 import pytz
 import bcrypt
+import time
+import secrets
+from bson import ObjectId
+import gridfs
+import uuid
+import asyncio
+import urllib.request
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from media import build_image_variants , extract_cover_art_window , extract_cover_art_file , probe_audio_window , probe_audio_file , id3v2_size , AUDIO_PROBE_HEADER_BYTES , AUDIO_PROBE_MAX_HEADER_BYTES , AUDIO_PROBE_TAIL_BYTES
 
 origins = ["*"]
 
 load_dotenv()
-app = FastAPI()
+
+#Background work that lives as long as the server process: the complaint pipeline
+#sweeper and the media process pool. Needs a long-running server (Docker/uvicorn),
+#a serverless deploy gives no guarantee these keep running between requests
+@asynccontextmanager
+async def lifespan(app):
+    sweeper = asyncio.create_task(sweep_complaint_pipelines())
+    try:
+        yield
+    finally:
+        sweeper.cancel()
+        await asyncio.gather(sweeper, return_exceptions=True)
+        shutdown_media_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 #Email config
 conf = ConnectionConfig(
@@ -74,6 +99,155 @@ async def upload(file:UploadFile = File(...)):
         "public_id":response.get("public_id")
     }
 
+#Media worker pool (image variants and audio probing)
+media_pool = {"executor": None}
+
+def get_media_pool():
+    # Created on first use so importing the app never spawns worker processes
+    if media_pool["executor"] is None:
+        media_pool["executor"] = ProcessPoolExecutor(max_workers=int(os.getenv("MEDIA_WORKERS", "2")))
+    return media_pool["executor"]
+
+def shutdown_media_pool(executor=None):
+    executor = executor or media_pool["executor"]
+    if executor is None:
+        return
+    if media_pool["executor"] is executor:
+        media_pool["executor"] = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+async def run_in_media_pool(func, *args):
+    loop = asyncio.get_running_loop()
+    executor = get_media_pool()
+    try:
+        return await loop.run_in_executor(executor, func, *args)
+    except BrokenProcessPool:
+        # A worker died (crash/OOM); replace the pool and retry once
+        print("Media worker pool broken, recreating it.")
+        shutdown_media_pool(executor)
+        return await loop.run_in_executor(get_media_pool(), func, *args)
+
+#Image variants
+MAX_REMOTE_IMAGE_BYTES = 10 * 1024 * 1024
+
+def download_image(url: str):
+    # Bounded read so an oversized remote image cannot exhaust memory
+    with urllib.request.urlopen(url, timeout=10) as response:
+        data = response.read(MAX_REMOTE_IMAGE_BYTES + 1)
+    if len(data) > MAX_REMOTE_IMAGE_BYTES:
+        raise Exception(f"Image at {url} is larger than {MAX_REMOTE_IMAGE_BYTES} bytes.")
+    return data
+
+async def destroy_image_variants(variants):
+    public_ids = [item["public_id"] for formats in variants.values() for item in formats.values()]
+    await asyncio.gather(*[
+        asyncio.to_thread(cloudinary.uploader.destroy, public_id, resource_type = "image")
+        for public_id in public_ids
+    ], return_exceptions=True)
+
+async def upload_image_variants(variant_bytes, folder: str, public_id_prefix: str | None = None):
+    # Returns {"small": {"webp": {"url": ..., "public_id": ...}, ...}, ...}
+    # With a prefix the public ids are deterministic, so a retried upload overwrites instead of duplicating
+    jobs = [(name, fmt, content) for name, formats in variant_bytes.items() for fmt, content in formats.items()]
+    results = await asyncio.gather(*[
+        asyncio.to_thread(
+            cloudinary.uploader.upload, content, resource_type = "image", folder = folder,
+            **({"public_id": f"{public_id_prefix}_{name}_{fmt}", "overwrite": True} if public_id_prefix else {})
+        )
+        for name, fmt, content in jobs
+    ], return_exceptions=True)
+    variants = {}
+    error = None
+    for (name, fmt, _), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            error = result
+            continue
+        variants.setdefault(name, {})[fmt] = {
+            "url": result.get("secure_url"),
+            "public_id": result.get("public_id")
+        }
+    if error is not None:
+        # All-or-nothing so a partial set never ends up on a document
+        await destroy_image_variants(variants)
+        raise error
+    return variants
+
+def image_variant_url(variants, name, fmt="webp"):
+    if not variants or name not in variants or fmt not in variants[name]:
+        return None
+    return variants[name][fmt]["url"]
+
+#Audio metadata
+AUDIO_MEASURED_FIELDS = ["duration", "bitRate", "sampleRate", "codec", "format"]
+AUDIO_TAG_FIELDS = ["title", "artist", "album", "genre", "year"]
+
+AUDIO_UPLOAD_CHUNK_BYTES = 6 * 1024 * 1024
+
+async def read_audio_window(upload: UploadFile):
+    # Reads just the header and tail windows of the upload, then rewinds for the real upload
+    head = await upload.read(AUDIO_PROBE_HEADER_BYTES)
+    tag_size = id3v2_size(head)
+    if tag_size:
+        # Large embedded artwork can push the first audio frame past the default window.
+        # tag_size comes from the file itself, so the window is capped; bigger tags use the full-file fallback
+        extra = min(tag_size + AUDIO_PROBE_HEADER_BYTES, AUDIO_PROBE_MAX_HEADER_BYTES) - len(head)
+        if extra > 0:
+            head += await upload.read(extra)
+    file_size = upload.size
+    if file_size is None:
+        file_size = await asyncio.to_thread(upload.file.seek, 0, io.SEEK_END)
+    tail = b""
+    if file_size > len(head):
+        # Ogg keeps the length in its last page and MP4 often stores moov at the end
+        await upload.seek(max(file_size - AUDIO_PROBE_TAIL_BYTES, len(head)))
+        tail = await upload.read(AUDIO_PROBE_TAIL_BYTES)
+    await upload.seek(0)
+    return head, file_size, tail
+
+def rewound(func, fileobj):
+    try:
+        return func(fileobj)
+    finally:
+        fileobj.seek(0)
+
+async def probe_audio(window, filename: str, fileobj=None):
+    head, file_size, tail = window
+    started = time.perf_counter()
+    # Probing only improves on client metadata, so any failure here must not fail the upload
+    try:
+        probed = await run_in_media_pool(probe_audio_window, head, file_size, tail)
+        source = "window"
+        if fileobj is not None and (not probed or probed.get("duration") is None):
+            # Metadata larger than the windows (big moov atom or FLAC picture); mutagen seeks the full file itself
+            full = await asyncio.to_thread(rewound, probe_audio_file, fileobj)
+            if full:
+                probed = full
+                source = "full file"
+    except Exception as e:
+        print(f"Probe of {filename} failed: {e}")
+        return None
+    print(f"Probed {filename} ({source}) in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return probed
+
+async def extract_audio_cover_art(window, fileobj=None):
+    cover_art = await run_in_media_pool(extract_cover_art_window, *window)
+    if cover_art is None and fileobj is not None:
+        cover_art = await asyncio.to_thread(rewound, extract_cover_art_file, fileobj)
+    return cover_art
+
+def apply_probed_metadata(track, probed):
+    # Measured values always win; tags only fill fields that are missing or "Unknown ..."
+    if not probed:
+        return track
+    for field in AUDIO_MEASURED_FIELDS:
+        if probed.get(field) is not None:
+            track[field] = probed[field]
+    for field in AUDIO_TAG_FIELDS:
+        current = track.get(field)
+        if probed.get(field) is not None and (current in (None, "") or str(current).startswith("Unknown")):
+            track[field] = probed[field]
+    return track
+
 class TrackResponse(BaseModel):
     id: str = Field(..., alias="_id")
     duration: int
@@ -86,12 +260,14 @@ class TrackResponse(BaseModel):
     format: str
     bitRate: int | None = None
     sampleRate: int | None = None
+    codec: str | None = None
     originalFilename: str
     cloudinary_url: str
     cloudinary_id: str
     created_at: datetime
     like_count: int
     thumbnail: str | None
+    thumbnail_variants: dict | None = None
 
 class YouTubeURL(BaseModel):
     url: str
@@ -100,6 +276,8 @@ class YouTubeURL(BaseModel):
 @app.post("/api/upload/youtube/url")
 async def upload_from_youtube_link(data : YouTubeURL):
      client = None
+     doc = None
+     thumbnail_variants = None
      try:
         with yt_dlp.YoutubeDL({'format': 'bestaudio'}) as ydl:
             info = ydl.extract_info(data.url, download=False)
@@ -115,13 +293,18 @@ async def upload_from_youtube_link(data : YouTubeURL):
             '-f', 'mp3', '-vn', '-acodec', 'libmp3lame', '-ab', '192k',
             '-hide_banner', '-loglevel', 'error', 'pipe:1'
         ]
-        result = subprocess.run(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        result = await asyncio.to_thread(subprocess.run, ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         if result.returncode != 0:
             raise HTTPException(status_code=500, detail="FFmpeg failed: " + result.stderr.decode())
         
         mp3_data = io.BytesIO(result.stdout)
         original_filename = f"{title}.mp3"
         mp3_data.name = original_filename
+        probed = await probe_audio(
+            (result.stdout[:AUDIO_PROBE_HEADER_BYTES], len(result.stdout), result.stdout[-AUDIO_PROBE_TAIL_BYTES:]),
+            original_filename,
+            mp3_data
+        )
 
         # Upload to Cloudinary (as video resource for audio)
         upload_result = cloudinary.uploader.upload(
@@ -154,6 +337,19 @@ async def upload_from_youtube_link(data : YouTubeURL):
         
         if year is not None:
            track_doc["year"] = year
+        apply_probed_metadata(track_doc, probed)
+
+        # Downscale the full-size YouTube thumbnail for list tiles
+        if thumbnail:
+            try:
+                thumbnail_data = await asyncio.to_thread(download_image, thumbnail)
+                variant_bytes = await run_in_media_pool(build_image_variants, thumbnail_data)
+                thumbnail_variants = await upload_image_variants(variant_bytes, "my-music-web-app/data/thumbnails/")
+                track_doc["thumbnail"] = image_variant_url(thumbnail_variants, "medium")
+                track_doc["thumbnail_variants"] = thumbnail_variants
+            except Exception as e:
+                thumbnail_variants = None
+                print(f"Thumbnail variants not generated: {e}")
 
         client = MongoClient(os.getenv("MONGODB_URL"))
         client.admin.command('ping')
@@ -172,6 +368,9 @@ async def upload_from_youtube_link(data : YouTubeURL):
         return track_doc
 
      except Exception as e:
+        if thumbnail_variants and doc is None:
+            # Song was not saved, so nothing points at the variants
+            await destroy_image_variants(thumbnail_variants)
         raise HTTPException(status_code=500, detail=str(e))
      finally:
         if client :
@@ -407,16 +606,41 @@ async def upload_music(
     audio_file: UploadFile = File(...),
     metadata: str = Form(...)
 ):
+    doc = None
+    thumbnail_variants = None
     try:
         client = None
         # Parse metadata
         track_metadata = json.loads(metadata)
         
-        # Upload to Cloudinary
-        audio_contents = await audio_file.read()
-        cloudinary_result = cloudinary.uploader.upload(
-           audio_contents , 
-           resource_type = "auto",
+        # Probe the header/tail windows instead of trusting client-sent technical metadata
+        audio_window = await read_audio_window(audio_file)
+        probed = await probe_audio(audio_window, audio_file.filename, audio_file.file)
+        apply_probed_metadata(track_metadata, probed)
+        track_metadata["fileSize"] = audio_window[1]
+        track_metadata.setdefault("originalFilename", audio_file.filename)
+
+        # Embedded cover art becomes the song thumbnail
+        # (read before the upload, upload_large closes the file when it is done)
+        thumbnail = "null"
+        thumbnail_variants = None
+        try:
+            cover_art = await extract_audio_cover_art(audio_window, audio_file.file)
+            if cover_art:
+                variant_bytes = await run_in_media_pool(build_image_variants, cover_art)
+                thumbnail_variants = await upload_image_variants(variant_bytes, "my-music-web-app/data/thumbnails/")
+                thumbnail = image_variant_url(thumbnail_variants, "medium")
+        except Exception as e:
+            thumbnail_variants = None
+            print(f"Cover art variants not generated: {e}")
+
+        # Upload to Cloudinary in chunks so only one chunk is held in memory at a time
+        cloudinary_result = await asyncio.to_thread(
+           cloudinary.uploader.upload_large,
+           audio_file.file , 
+           filename = audio_file.filename ,
+           resource_type = "video",
+           chunk_size = AUDIO_UPLOAD_CHUNK_BYTES,
            folder = "my-music-web-app/data/assets/"
            )
         
@@ -430,7 +654,8 @@ async def upload_music(
             **track_metadata,
             "cloudinary_url": cloudinary_result["secure_url"],
             "cloudinary_id": cloudinary_result["public_id"],
-            "thumbnail":"null",
+            "thumbnail":thumbnail,
+            "thumbnail_variants":thumbnail_variants,
             "like_count":0,
             "created_at":datetime.now(timezone.utc)
         })
@@ -445,13 +670,23 @@ async def upload_music(
             "genre": saved_track["genre"],
             "album": saved_track["album"],
             "duration": saved_track["duration"],
+            "year": saved_track.get("year"),
+            "fileSize": saved_track.get("fileSize"),
+            "format": saved_track.get("format"),
+            "bitRate": saved_track.get("bitRate"),
+            "sampleRate": saved_track.get("sampleRate"),
+            "codec": saved_track.get("codec"),
             "cloudinary_url": saved_track["cloudinary_url"],
-            "thumbnail":"null",
+            "thumbnail":thumbnail,
+            "thumbnail_variants":thumbnail_variants,
             "like_count":0,
             "created_at": created_at_ist.isoformat()
         }
         
     except Exception as e:
+        if thumbnail_variants and doc is None:
+            # Song was not saved, so nothing points at the variants
+            await destroy_image_variants(thumbnail_variants)
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         if client :
@@ -484,56 +719,29 @@ async def fetchMusic():
            print("Connection closed with database.")          
 
 #student-complaint-management-system
-#For complaint registering
-@app.post("/api/register/complaint/student")
-async def complainRegister(
-    background_tasks: BackgroundTasks ,
-    file:UploadFile = File(...) , # for image upload
-    fullname:str = Form(...),
-    email:str = Form(...),
-    title:str = Form(...),
-    description:str = Form(...)
-):
-    client = None
-    contents = await file.read()
-    response = cloudinary.uploader.upload(
-        contents , 
-        filename = file.filename ,
-        resource_type = "auto",
-        folder = f"student-complaint-management-system/data/assets/{email}"
-    )
-
-    try:
-       client = MongoClient(os.getenv("MONGODB_URL"))
-       client.admin.command('ping')
-       print("Connection established with database successfully.")
-       db = client["mydb"]
-       collection = db["complaint"]
-       doc = collection.insert_one({
-            "fullname": fullname ,
-            "email":email,
-            "title":title,
-            "status":"pending",
-            "description":description,
-            "image_url":response.get("secure_url"),
-            "public_id":response.get("public_id"),
-            "created_at":datetime.now()
-       })
-       #Email sending for registered complaint 
-       async def sendConfirmationThroughemail(email_data:EmailSchema, background_tasks: BackgroundTasks):
-        message = MessageSchema(
-        subject=email_data.subject,
-        recipients=[email_data.email],
-        body=email_data.body,
-        subtype=MessageType.html
-        )
-        fm = FastMail(conf)
-        background_tasks.add_task(fm.send_message, message)
-
-
-       await sendConfirmationThroughemail(
-            EmailSchema(
-            email = f"{email}",
+COMPLAINT_PIPELINE_STAGES = ["upload", "variants", "notify_user", "notify_admin"]
+COMPLAINT_PIPELINE_RETRIES = 3
+COMPLAINT_PIPELINE_BACKOFF = 2
+COMPLAINT_PIPELINE_LEASE = 60
+COMPLAINT_PIPELINE_HEARTBEAT = 20
+COMPLAINT_PIPELINE_SWEEP_INTERVAL = 30
+COMPLAINT_PIPELINE_SWEEP_BATCH = 50
+COMPLAINT_PIPELINE_MAX_RUNS = 5
+COMPLAINT_PIPELINE_REQUEUE_DELAY = 300
+COMPLAINT_ATTACHMENT_BUCKET = "complaint_attachment"
+complaint_pipeline_tasks = set()
+
+def complaint_image_link(complaint, style):
+    # Emails link the downscaled copy when one exists; notifications do not wait for a failed upload
+    url = image_variant_url(complaint.get("image_variants"), "large") or complaint.get("image_url")
+    if not url:
+        return "Attachment unavailable"
+    return f'<a href="{url}" style="{style}">Click to View</a>'
+
+def complaint_user_email(complaint):
+    title = complaint["title"]
+    return EmailSchema(
+            email = f"{complaint['email']}",
             subject = f"{title[0].upper()}{title[1:]} Complaint",
             body = f"""
             <div style="font-family: Arial, sans-serif; padding: 20px; background-color: #f4f6f8; color: #333;">
@@ -547,9 +755,9 @@ async def complainRegister(
             </p>
 
             <ul style="list-style: none; padding: 0; font-size: 16px; line-height: 1.6;">
-            <li style="margin-bottom: 8px;"><strong>🆔 Complaint ID:</strong> {str(doc.inserted_id)}</li>
-            <li style="margin-bottom: 8px;"><strong>📝 Description:</strong> {description}</li>
-            <li style="margin-bottom: 8px;"><strong>📎 File/Image:</strong> <a href="{response.get("secure_url")}" style="color: #2980b9;">Click to View</a></li>
+            <li style="margin-bottom: 8px;"><strong>🆔 Complaint ID:</strong> {str(complaint['_id'])}</li>
+            <li style="margin-bottom: 8px;"><strong>📝 Description:</strong> {complaint['description']}</li>
+            <li style="margin-bottom: 8px;"><strong>📎 File/Image:</strong> {complaint_image_link(complaint, "color: #2980b9;")}</li>
             </ul>
 
             <p style="margin-top: 30px; font-size: 14px; color: #666;">
@@ -562,13 +770,12 @@ async def complainRegister(
             </div>
             </div>
             """
-            ),
-             background_tasks
             )
-       
-       created_at = collection.find_one({"_id": doc.inserted_id})["created_at"].astimezone(ZoneInfo("Asia/Kolkata"))
-       await sendConfirmationThroughemail(
-            EmailSchema(
+
+def complaint_admin_email(complaint):
+    title = complaint["title"]
+    created_at = complaint["created_at"].astimezone(ZoneInfo("Asia/Kolkata"))
+    return EmailSchema(
             email = os.getenv("MY_EMAIL_ID"),
             subject = f"{title[0].upper()}{title[1:]} Complaint Received",
             body = f"""
@@ -584,12 +791,12 @@ async def complainRegister(
             </p>
 
             <ul style="list-style: none; padding: 0; font-size: 16px; line-height: 1.6; margin: 0;">
-            <li style="margin-bottom: 8px;"><strong>🆔 Complaint ID:</strong> {str(doc.inserted_id)}</li>
-            <li style="margin-bottom: 8px; word-wrap: break-word; white-space: normal;"><strong>👤 Username:</strong> {fullname}</li>
-            <li style="margin-bottom: 8px;"><strong>📧 User Email:</strong> {email}</li>
+            <li style="margin-bottom: 8px;"><strong>🆔 Complaint ID:</strong> {str(complaint['_id'])}</li>
+            <li style="margin-bottom: 8px; word-wrap: break-word; white-space: normal;"><strong>👤 Username:</strong> {complaint['fullname']}</li>
+            <li style="margin-bottom: 8px;"><strong>📧 User Email:</strong> {complaint['email']}</li>
             <li style="margin-bottom: 8px;"><strong>🕒 Created At:</strong> {created_at}</li>
-            <li style="margin-bottom: 8px; word-wrap: break-word; white-space: normal;"><strong>📝 Description:</strong> {description}</li>
-            <li style="margin-bottom: 8px;"><strong>📎 File/Image Link:</strong> <a href="{response.get("secure_url")}" style="color: #2980b9; word-break: break-word;">Click to View</a></li>
+            <li style="margin-bottom: 8px; word-wrap: break-word; white-space: normal;"><strong>📝 Description:</strong> {complaint['description']}</li>
+            <li style="margin-bottom: 8px;"><strong>📎 File/Image Link:</strong> {complaint_image_link(complaint, "color: #2980b9; word-break: break-word;")}</li>
             </ul>
 
             <p style="margin-top: 30px; font-size: 14px; color: #666;">
@@ -602,10 +809,345 @@ async def complainRegister(
             </div>
             </div>
             """
-            ) ,
-             background_tasks
             )
 
+async def send_complaint_email(email_data:EmailSchema):
+    message = MessageSchema(
+        subject=email_data.subject,
+        recipients=[email_data.email],
+        body=email_data.body,
+        subtype=MessageType.html
+    )
+    fm = FastMail(conf)
+    await fm.send_message(message)
+
+async def run_stage_with_retry(complaint_id, stage, make_call):
+    # make_call returns a fresh awaitable per attempt
+    for attempt in range(1, COMPLAINT_PIPELINE_RETRIES + 1):
+        try:
+            return await make_call()
+        except Exception as e:
+            print(f"Complaint {complaint_id} stage {stage} attempt {attempt} failed: {e}")
+            if attempt == COMPLAINT_PIPELINE_RETRIES:
+                raise
+            await asyncio.sleep(COMPLAINT_PIPELINE_BACKOFF ** attempt)
+
+async def run_complaint_pipeline(complaint_id):
+    client = None
+    heartbeat = None
+    run_id = uuid.uuid4().hex
+    try:
+        client = MongoClient(os.getenv("MONGODB_URL"))
+        db = client["mydb"]
+        collection = db["complaint"]
+        fs = gridfs.GridFS(db, collection=COMPLAINT_ATTACHMENT_BUCKET)
+        # Claim the job with a lease so a resumed run and a live run never overlap
+        now = datetime.now(timezone.utc)
+        complaint = await asyncio.to_thread(
+            collection.find_one_and_update,
+            {"_id": complaint_id, "$or": [
+                {"pipeline.state": "queued", "pipeline.next_run_at": {"$not": {"$gt": now}}},
+                {"pipeline.state": "running", "pipeline.lease_until": {"$lt": now}}
+            ]},
+            {"$set": {
+                "pipeline.state": "running",
+                "pipeline.owner": run_id,
+                "pipeline.lease_until": now + timedelta(seconds=COMPLAINT_PIPELINE_LEASE)
+            }, "$inc": {"pipeline.runs": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not complaint:
+            return
+        print(f"Complaint {complaint_id} pipeline started (run {complaint['pipeline']['runs']}).")
+        heartbeat = asyncio.create_task(renew_complaint_lease(collection, complaint_id, run_id))
+        stages = complaint["pipeline"]["stages"]
+
+        # Stages fail independently: a failed upload or user email must not hold back the admin email
+        failures = {}
+        for stage in COMPLAINT_PIPELINE_STAGES:
+            if stages.get(stage) == "done":
+                continue
+            if stage == "variants" and "upload" in failures:
+                # Variants would release the staged attachment the upload retry still needs
+                continue
+            try:
+                if complaint_stage_applied(complaint, stage):
+                    # A crashed run already wrote the result but never marked the stage done
+                    pass
+                elif stage == "upload":
+                    await upload_complaint_attachment(collection, fs, complaint)
+                elif stage == "variants":
+                    await build_complaint_variants(collection, fs, complaint)
+                elif stage == "notify_user":
+                    email_data = complaint_user_email(complaint)
+                    await run_stage_with_retry(complaint_id, stage, lambda: send_complaint_email(email_data))
+                elif stage == "notify_admin":
+                    email_data = complaint_admin_email(complaint)
+                    await run_stage_with_retry(complaint_id, stage, lambda: send_complaint_email(email_data))
+            except Exception as e:
+                print(f"Complaint {complaint_id} stage {stage} failed: {e}")
+                failures[stage] = e
+                continue
+            await asyncio.to_thread(
+                collection.update_one,
+                {"_id": complaint_id, "pipeline.owner": run_id},
+                {"$set": {f"pipeline.stages.{stage}": "done"}}
+            )
+
+        if failures:
+            await fail_complaint_pipeline(collection, fs, complaint, failures, run_id)
+            return
+
+        await asyncio.to_thread(
+            collection.update_one,
+            {"_id": complaint_id, "pipeline.owner": run_id},
+            {"$set": {"pipeline.state": "done", "pipeline.error": None},
+             "$unset": {"pipeline.lease_until": "", "pipeline.owner": "", "pipeline.next_run_at": "", "pipeline.failed_at": ""}}
+        )
+        print(f"Complaint {complaint_id} pipeline finished.")
+    except Exception as e:
+        # Job stays queued/running and the sweeper picks it up again once the lease expires
+        print(f"Complaint {complaint_id} pipeline interrupted: {e}")
+    finally:
+        if heartbeat :
+            heartbeat.cancel()
+        if client :
+            client.close()
+
+def complaint_stage_applied(complaint, stage):
+    if stage == "upload":
+        return complaint.get("image_url") is not None
+    if stage == "variants":
+        # The staged attachment is only released once image_variants has been written
+        return complaint.get("image_url") is not None and not complaint.get("attachment")
+    return False
+
+async def renew_complaint_lease(collection, complaint_id, run_id):
+    # Short lease kept alive while this run is healthy, so a crashed run is retried within a minute
+    while True:
+        await asyncio.sleep(COMPLAINT_PIPELINE_HEARTBEAT)
+        try:
+            await asyncio.to_thread(
+                collection.update_one,
+                {"_id": complaint_id, "pipeline.owner": run_id, "pipeline.state": "running"},
+                {"$set": {"pipeline.lease_until": datetime.now(timezone.utc) + timedelta(seconds=COMPLAINT_PIPELINE_LEASE)}}
+            )
+        except Exception as e:
+            print(f"Complaint {complaint_id} lease renewal failed: {e}")
+
+async def fail_complaint_pipeline(collection, fs, complaint, failures, run_id):
+    complaint_id = complaint["_id"]
+    runs = complaint["pipeline"].get("runs", 1)
+    error = "; ".join(f"{stage}: {e}" for stage, e in failures.items())
+    failed_stages = {f"pipeline.stages.{stage}": "failed" for stage in failures}
+    # Invalid email data can never succeed, so it does not use up the retry budget
+    permanent = all(isinstance(e, ValidationError) for e in failures.values())
+    if runs < COMPLAINT_PIPELINE_MAX_RUNS and not permanent:
+        # Re-queue with a growing delay; the sweeper starts it once next_run_at has passed
+        delay = COMPLAINT_PIPELINE_REQUEUE_DELAY * 2 ** (runs - 1)
+        # Owner filter: a run that lost its lease must not overwrite the run that took over
+        await asyncio.to_thread(
+            collection.update_one,
+            {"_id": complaint_id, "pipeline.owner": run_id},
+            {"$set": {
+                **failed_stages,
+                "pipeline.state": "queued",
+                "pipeline.error": error,
+                "pipeline.next_run_at": datetime.now(timezone.utc) + timedelta(seconds=delay)
+            }, "$unset": {"pipeline.lease_until": "", "pipeline.owner": ""}}
+        )
+        print(f"Complaint {complaint_id} pipeline failed at {', '.join(failures)}, retrying in {delay} s.")
+        return
+    # Retry budget spent (or nothing left worth retrying): give up and drop the staged attachment bytes
+    result = await asyncio.to_thread(
+        collection.update_one,
+        {"_id": complaint_id, "pipeline.owner": run_id},
+        {"$set": {
+            **failed_stages,
+            "pipeline.state": "failed",
+            "pipeline.error": error,
+            "pipeline.failed_at": datetime.now(timezone.utc)
+        }, "$unset": {"pipeline.lease_until": "", "pipeline.owner": "", "pipeline.next_run_at": ""}}
+    )
+    if result.matched_count == 0:
+        print(f"Complaint {complaint_id} lease lost, leaving the job to the run that took over.")
+        return
+    await release_complaint_attachment(collection, fs, complaint)
+    print(f"Complaint {complaint_id} pipeline failed at {', '.join(failures)}, giving up after {runs} runs.")
+
+def read_complaint_attachment(fs, complaint):
+    attachment = complaint.get("attachment")
+    if not attachment:
+        raise Exception("Complaint attachment is no longer staged.")
+    return fs.get(attachment["file_id"]).read()
+
+async def release_complaint_attachment(collection, fs, complaint):
+    attachment = complaint.get("attachment")
+    if not attachment:
+        return
+    await asyncio.to_thread(collection.update_one, {"_id": complaint["_id"]}, {"$unset": {"attachment": ""}})
+    complaint.pop("attachment", None)
+    try:
+        await asyncio.to_thread(fs.delete, attachment["file_id"])
+    except Exception as e:
+        print(f"Complaint {complaint['_id']} staged attachment not deleted: {e}")
+
+async def upload_complaint_attachment(collection, fs, complaint):
+    complaint_id = complaint["_id"]
+    attachment = complaint["attachment"]
+    contents = await asyncio.to_thread(read_complaint_attachment, fs, complaint)
+    response = await run_stage_with_retry(complaint_id, "upload", lambda: asyncio.to_thread(
+        cloudinary.uploader.upload,
+        contents ,
+        filename = attachment["filename"] ,
+        resource_type = "auto",
+        folder = f"student-complaint-management-system/data/assets/{complaint['email']}",
+        public_id = str(complaint_id),
+        overwrite = True
+    ))
+    try:
+        result = await run_stage_with_retry(complaint_id, "upload", lambda: asyncio.to_thread(
+            collection.update_one,
+            {"_id": complaint_id},
+            {"$set": {
+                "image_url": response.get("secure_url"),
+                "public_id": response.get("public_id")
+            }}
+        ))
+        if result.matched_count == 0:
+            raise Exception("Complaint no longer exists.")
+    except Exception:
+        # Compensation: never leave an asset behind that no complaint points to
+        await asyncio.to_thread(cloudinary.uploader.destroy, response.get("public_id"), resource_type = response.get("resource_type", "image"))
+        print(f"Complaint {complaint_id} orphaned upload {response.get('public_id')} deleted.")
+        raise
+    complaint["image_url"] = response.get("secure_url")
+    complaint["public_id"] = response.get("public_id")
+
+async def build_complaint_variants(collection, fs, complaint):
+    complaint_id = complaint["_id"]
+    attachment = complaint.get("attachment")
+    variants = None
+    if attachment and (attachment.get("content_type") or "").startswith("image/"):
+        try:
+            contents = await asyncio.to_thread(read_complaint_attachment, fs, complaint)
+            variant_bytes = await run_in_media_pool(build_image_variants, contents)
+        except Exception as e:
+            # Undecodable images keep only the original upload
+            print(f"Complaint {complaint_id} image variants skipped: {e}")
+            variant_bytes = None
+        if variant_bytes:
+            try:
+                variants = await run_stage_with_retry(complaint_id, "variants", lambda: upload_image_variants(
+                    variant_bytes,
+                    f"student-complaint-management-system/data/assets/{complaint['email']}/variants",
+                    str(complaint_id)
+                ))
+            except Exception as e:
+                # Variants are optional; emails fall back to the original upload
+                print(f"Complaint {complaint_id} image variants not uploaded: {e}")
+                variants = None
+    try:
+        result = await run_stage_with_retry(complaint_id, "variants", lambda: asyncio.to_thread(
+            collection.update_one,
+            {"_id": complaint_id},
+            {"$set": {"image_variants": variants}}
+        ))
+        if result.matched_count == 0:
+            raise Exception("Complaint no longer exists.")
+    except Exception:
+        if variants:
+            await destroy_image_variants(variants)
+            print(f"Complaint {complaint_id} orphaned image variants deleted.")
+        raise
+    complaint["image_variants"] = variants
+    # Both uploads are done, the staged bytes are no longer needed
+    await release_complaint_attachment(collection, fs, complaint)
+
+def start_complaint_pipeline(complaint_id):
+    # Keep a reference so the task is not garbage-collected while it runs
+    task = asyncio.create_task(run_complaint_pipeline(complaint_id))
+    complaint_pipeline_tasks.add(task)
+    task.add_done_callback(complaint_pipeline_tasks.discard)
+
+async def sweep_complaint_pipelines():
+    # Starts queued jobs that are due and running jobs whose lease expired (crashed or restarted worker)
+    while True:
+        client = None
+        try:
+            client = MongoClient(os.getenv("MONGODB_URL"))
+            collection = client["mydb"]["complaint"]
+            await asyncio.to_thread(ensure_complaint_indexes, collection)
+            now = datetime.now(timezone.utc)
+            due = await asyncio.to_thread(
+                lambda: [doc["_id"] for doc in collection.find(
+                    {"$or": [
+                        {"pipeline.state": "queued", "pipeline.next_run_at": {"$not": {"$gt": now}}},
+                        {"pipeline.state": "running", "pipeline.lease_until": {"$lt": now}}
+                    ]},
+                    {"_id": 1}
+                ).limit(COMPLAINT_PIPELINE_SWEEP_BATCH)]
+            )
+            for complaint_id in due:
+                start_complaint_pipeline(complaint_id)
+            if due:
+                print(f"Started {len(due)} complaint pipelines from sweep.")
+        except Exception as e:
+            print(f"Complaint pipeline sweep failed: {e}")
+        finally:
+            if client :
+                client.close()
+        await asyncio.sleep(COMPLAINT_PIPELINE_SWEEP_INTERVAL)
+
+#For complaint registering
+@app.post("/api/register/complaint/student")
+async def complainRegister(
+    background_tasks: BackgroundTasks ,
+    file:UploadFile = File(...) , # for image upload
+    fullname:str = Form(...),
+    email:EmailStr = Form(...),
+    title:str = Form(..., min_length=1),
+    description:str = Form(...)
+):
+    client = None
+    file_id = None
+    fs = None
+
+    try:
+       client = MongoClient(os.getenv("MONGODB_URL"))
+       client.admin.command('ping')
+       print("Connection established with database successfully.")
+       db = client["mydb"]
+       collection = db["complaint"]
+       # Attachment is staged in GridFS until the pipeline has uploaded it
+       fs = gridfs.GridFS(db, collection=COMPLAINT_ATTACHMENT_BUCKET)
+       file_id = await asyncio.to_thread(fs.put, file.file, filename=file.filename, content_type=file.content_type)
+       doc = collection.insert_one({
+            "fullname": fullname ,
+            "email":email,
+            "title":title,
+            "status":"pending",
+            "description":description,
+            "image_url":None,
+            "public_id":None,
+            "image_variants":None,
+            "attachment":{
+                "file_id":file_id,
+                "filename":file.filename,
+                "content_type":file.content_type
+            },
+            "pipeline":{
+                "state":"queued",
+                "stages":{stage: "pending" for stage in COMPLAINT_PIPELINE_STAGES},
+                "runs":0,
+                "error":None
+            },
+            "created_at":datetime.now()
+       })
+       file_id = None
+       invalidate_complaint_status_counts()
+       background_tasks.add_task(run_complaint_pipeline, doc.inserted_id)
+
        return{
         "Message": "Student complain register successfully.",
         "_id": str(doc.inserted_id),
@@ -614,8 +1156,9 @@ async def complainRegister(
         "title":title,
         "status":"pending",
         "description":description,
-        "url":response.get("secure_url"),
-        "public_id":response.get("public_id")
+        "url":None,
+        "public_id":None,
+        "attachment_status":"queued"
     }
     except ConnectionFailure as e:
         return {
@@ -628,10 +1171,252 @@ async def complainRegister(
         "Error":str(e)
         }
     finally:
+        if file_id is not None :
+            # Complaint was not saved, drop the staged attachment
+            try:
+                fs.delete(file_id)
+            except Exception as e:
+                print(f"Staged attachment {file_id} not deleted: {e}")
         if client :
             client.close()
             print("Connection closed with database.")   
 
+#Complaint admin
+COMPLAINT_STATUSES = ["pending", "in_progress", "resolved", "rejected"]
+COMPLAINT_STATUS_TRANSITIONS = {
+    "pending": ["in_progress", "resolved", "rejected"],
+    "in_progress": ["resolved", "rejected"],
+    "resolved": [],
+    "rejected": [],
+}
+COMPLAINT_STATUS_COUNTS_TTL = 60
+complaint_status_counts_cache = {"data": None, "expires_at": 0.0}
+complaint_indexes_ready = False
+
+def ensure_complaint_indexes(collection):
+    # Compound indexes back every list filter with the keyset sort (created_at, _id)
+    global complaint_indexes_ready
+    if complaint_indexes_ready:
+        return
+    collection.create_index([("created_at", DESCENDING), ("_id", DESCENDING)])
+    collection.create_index([("status", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+    collection.create_index([("email", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+    collection.create_index([("email", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+    collection.create_index([("pipeline.state", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+    complaint_indexes_ready = True
+
+def encode_complaint_cursor(doc):
+    return f"{doc['created_at'].isoformat()}|{doc['_id']}"
+
+def decode_complaint_cursor(cursor: str):
+    try:
+        created_at, _id = cursor.split("|", 1)
+        return datetime.fromisoformat(created_at), ObjectId(_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+def require_admin(x_admin_key: str | None = Header(None)):
+    # Shared secret from ADMIN_API_KEY; refuse everything when it is not configured
+    admin_key = os.getenv("ADMIN_API_KEY")
+    if not admin_key:
+        raise HTTPException(status_code=503, detail="Admin API is not configured.")
+    if not x_admin_key or not secrets.compare_digest(x_admin_key, admin_key):
+        raise HTTPException(status_code=401, detail="Invalid admin key.")
+
+def invalidate_complaint_status_counts():
+    complaint_status_counts_cache["data"] = None
+    complaint_status_counts_cache["expires_at"] = 0.0
+
+#For listing complaints (keyset pagination)
+@app.get("/api/admin/complaint/list", dependencies=[Depends(require_admin)])
+async def listComplaints(
+    status: str | None = Query(None),
+    email: str | None = Query(None),
+    pipeline_state: str | None = Query(None),
+    from_date: datetime | None = Query(None),
+    to_date: datetime | None = Query(None),
+    cursor: str | None = Query(None),
+    limit: int = Query(20, ge=1, le=100)
+):
+    if status is not None and status not in COMPLAINT_STATUSES:
+        raise HTTPException(status_code=400, detail="Invalid status.")
+    client = None
+    try:
+       client = MongoClient(os.getenv("MONGODB_URL"))
+       client.admin.command('ping')
+       print("Connection established with database successfully.")
+       db = client["mydb"]
+       collection = db["complaint"]
+       ensure_complaint_indexes(collection)
+
+       query = {}
+       if status is not None:
+           query["status"] = status
+       if email is not None:
+           query["email"] = email
+       if pipeline_state is not None:
+           query["pipeline.state"] = pipeline_state
+       if from_date is not None or to_date is not None:
+           query["created_at"] = {}
+           if from_date is not None:
+               query["created_at"]["$gte"] = from_date
+           if to_date is not None:
+               query["created_at"]["$lte"] = to_date
+       if cursor is not None:
+           last_created_at, last_id = decode_complaint_cursor(cursor)
+           query = {"$and": [query, {"$or": [
+               {"created_at": {"$lt": last_created_at}},
+               {"created_at": last_created_at, "_id": {"$lt": last_id}}
+           ]}]}
+
+       docs = list(
+           collection.find(query, {"attachment": 0})
+           .sort([("created_at", DESCENDING), ("_id", DESCENDING)])
+           .limit(limit + 1)
+       )
+       has_more = len(docs) > limit
+       docs = docs[:limit]
+       next_cursor = encode_complaint_cursor(docs[-1]) if has_more else None
+       for doc in docs:
+           doc["_id"] = str(doc["_id"])
+       return{
+        "ConnectionToDatabase":"Okay",
+        "Status" : True ,
+        "Data" : docs,
+        "NextCursor" : next_cursor,
+        "Message":"Complaints fetched successfully."
+       }
+    except HTTPException:
+        raise
+    except ConnectionFailure as e:
+        return {
+        "Message":"Error in connecting to database.",
+        "Status":False
+        }
+    except Exception as e :
+        return {
+        "ConnectionToDatabase":"Okay",
+        "Message":"Unable to fetch the complaints.",
+        "Error":str(e),
+        "Status":False
+        }
+    finally:
+        if client :
+            client.close()
+            print("Connection closed with database.")
+
+class ComplaintStatusUpdate(BaseModel):
+    status: str
+
+#For updating complaint status
+@app.patch("/api/admin/complaint/{complaint_id}/status", dependencies=[Depends(require_admin)])
+async def updateComplaintStatus(complaint_id: str, data: ComplaintStatusUpdate):
+    if data.status not in COMPLAINT_STATUSES:
+        raise HTTPException(status_code=400, detail="Invalid status.")
+    if not ObjectId.is_valid(complaint_id):
+        raise HTTPException(status_code=400, detail="Invalid complaint id.")
+    client = None
+    try:
+       client = MongoClient(os.getenv("MONGODB_URL"))
+       client.admin.command('ping')
+       print("Connection established with database successfully.")
+       db = client["mydb"]
+       collection = db["complaint"]
+       allowed_from = [
+           current for current, targets in COMPLAINT_STATUS_TRANSITIONS.items()
+           if data.status in targets
+       ]
+       # Filter on the current status so concurrent transitions cannot overwrite each other
+       doc = collection.find_one_and_update(
+           {"_id": ObjectId(complaint_id), "status": {"$in": allowed_from}},
+           {"$set": {"status": data.status, "updated_at": datetime.now()}},
+           projection={"attachment": 0},
+           return_document=ReturnDocument.AFTER
+       )
+       if not doc:
+           current = collection.find_one({"_id": ObjectId(complaint_id)}, {"status": 1})
+           return {
+                "ConnectionToDatabase": "Okay",
+                "Status": False,
+                "Error": "Complaint not found" if not current else f"Cannot move complaint from {current['status']} to {data.status}",
+                "Message": "Update failed."
+           }
+       invalidate_complaint_status_counts()
+       doc["_id"] = str(doc["_id"])
+       return{
+        "ConnectionToDatabase":"Okay",
+        "Status" : True ,
+        "Data" : doc,
+        "Message":"Complaint status updated successfully."
+       }
+    except ConnectionFailure as e:
+        return {
+        "Message":"Error in connecting to database.",
+        "Status":False
+        }
+    except Exception as e :
+        return {
+        "ConnectionToDatabase":"Okay",
+        "Message":"Something went wrong.",
+        "Error":str(e),
+        "Status":False
+        }
+    finally:
+        if client :
+            client.close()
+            print("Connection closed with database.")
+
+#For dashboard status counts
+@app.get("/api/admin/complaint/status/count", dependencies=[Depends(require_admin)])
+async def complaintStatusCount():
+    if complaint_status_counts_cache["data"] is not None and time.monotonic() < complaint_status_counts_cache["expires_at"]:
+        return{
+         "ConnectionToDatabase":"Okay",
+         "Status" : True ,
+         "Data" : complaint_status_counts_cache["data"],
+         "Cached" : True,
+         "Message":"Complaint status count fetched successfully."
+        }
+    client = None
+    try:
+       client = MongoClient(os.getenv("MONGODB_URL"))
+       client.admin.command('ping')
+       print("Connection established with database successfully.")
+       db = client["mydb"]
+       collection = db["complaint"]
+       ensure_complaint_indexes(collection)
+       counts = {status: 0 for status in COMPLAINT_STATUSES}
+       for row in collection.aggregate([
+           {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+       ]):
+           counts[row["_id"]] = row["count"]
+       counts["total"] = sum(counts.values())
+       complaint_status_counts_cache["data"] = counts
+       complaint_status_counts_cache["expires_at"] = time.monotonic() + COMPLAINT_STATUS_COUNTS_TTL
+       return{
+        "ConnectionToDatabase":"Okay",
+        "Status" : True ,
+        "Data" : counts,
+        "Cached" : False,
+        "Message":"Complaint status count fetched successfully."
+       }
+    except ConnectionFailure as e:
+        return {
+        "Message":"Error in connecting to database.",
+        "Status":False
+        }
+    except Exception as e :
+        return {
+        "ConnectionToDatabase":"Okay",
+        "Message":"Something went wrong.",
+        "Error":str(e),
+        "Status":False
+        }
+    finally:
+        if client :
+            client.close()
+            print("Connection closed with database.")
+
 @app.get("/")
 def root():
     return {
@@ -0,0 +1,176 @@
+#Media processing helpers
+#These run inside the process pool, so they only take and return plain bytes/dicts
+import io
+from PIL import Image, ImageOps
+import mutagen
+from mutagen.easyid3 import EasyID3
+
+try:
+    import pillow_avif  # registers AVIF on Pillow builds without native support
+except ImportError:
+    pass
+
+IMAGE_VARIANT_SIZES = {"small": 96, "medium": 320, "large": 640}
+IMAGE_VARIANT_QUALITY = 80
+
+def image_variant_formats():
+    Image.init()
+    formats = ["webp"]
+    if "AVIF" in Image.SAVE:
+        formats.append("avif")
+    return formats
+
+def build_image_variants(data: bytes):
+    # Returns {"small": {"webp": b"...", "avif": b"..."}, ...}
+    image = Image.open(io.BytesIO(data))
+    # Let JPEG decode at reduced scale instead of full resolution
+    image.draft("RGB", (max(IMAGE_VARIANT_SIZES.values()),) * 2)
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+
+    formats = image_variant_formats()
+    variants = {}
+    for name, size in IMAGE_VARIANT_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        variants[name] = {}
+        for fmt in formats:
+            buffer = io.BytesIO()
+            resized.save(buffer, format=fmt.upper(), quality=IMAGE_VARIANT_QUALITY)
+            variants[name][fmt] = buffer.getvalue()
+    return variants
+
+def extract_cover_art_window(head: bytes, file_size: int, tail: bytes = b""):
+    return extract_cover_art_file(AudioWindow(head, file_size, tail))
+
+def extract_cover_art_file(fileobj):
+    # Embedded artwork from ID3 (APIC), FLAC/Ogg pictures or MP4 covr atoms
+    try:
+        audio = mutagen.File(fileobj)
+    except Exception:
+        return None
+    if audio is None:
+        return None
+    pictures = getattr(audio, "pictures", None)
+    if pictures:
+        return pictures[0].data
+    tags = audio.tags
+    if tags is None:
+        return None
+    if hasattr(tags, "getall"):
+        frames = tags.getall("APIC")
+        if frames:
+            return frames[0].data
+    covers = tags.get("covr") if hasattr(tags, "get") else None
+    if covers:
+        return bytes(covers[0])
+    return None
+
+AUDIO_PROBE_HEADER_BYTES = 256 * 1024
+AUDIO_PROBE_MAX_HEADER_BYTES = 1024 * 1024
+AUDIO_PROBE_TAIL_BYTES = 64 * 1024
+
+class AudioWindow(io.RawIOBase):
+    # Sparse view of a file: the header and tail windows sit at their real offsets
+    # and the gap between them reads as EOF. Formats that seek from the end (last
+    # Ogg page, trailing MP4 atoms, ID3v1) and size-based estimates such as CBR
+    # mp3 duration work without the whole file
+    def __init__(self, head: bytes, file_size: int, tail: bytes = b""):
+        self.head = head
+        self.file_size = max(file_size, len(head))
+        tail = tail[-(self.file_size - len(head)):] if self.file_size > len(head) else b""
+        self.tail = tail
+        self.tail_start = self.file_size - len(tail)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.file_size
+        self.position = max(offset, 0)
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.file_size - self.position
+        end = min(self.position + size, self.file_size)
+        chunks = []
+        while self.position < end:
+            if self.position < len(self.head):
+                chunk = self.head[self.position:min(end, len(self.head))]
+            elif self.position >= self.tail_start:
+                chunk = self.tail[self.position - self.tail_start:end - self.tail_start]
+            else:
+                break
+            chunks.append(chunk)
+            self.position += len(chunk)
+        return b"".join(chunks)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def id3v2_size(head: bytes):
+    # Full ID3v2 tag length (header + frames) from its syncsafe size field, 0 if absent
+    if len(head) < 10 or head[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in head[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if head[5] & 0x10 else 0
+    return 10 + size + footer
+
+def first_tag(tags, *keys):
+    for key in keys:
+        value = tags.get(key)
+        if value:
+            value = value[0] if isinstance(value, list) else value
+            return str(value).strip() or None
+    return None
+
+def probe_audio_window(head: bytes, file_size: int, tail: bytes = b""):
+    # Duration, bitrate, sample rate, codec and tags read from the header/tail windows only
+    return probe_audio_file(AudioWindow(head, file_size, tail))
+
+def probe_audio_file(fileobj):
+    try:
+        audio = mutagen.File(fileobj, easy=True)
+    except Exception:
+        audio = None
+    if audio is None:
+        # Stream info could not be parsed, but ID3 tags may still be readable
+        try:
+            fileobj.seek(0)
+            tags = EasyID3(fileobj)
+        except Exception:
+            return None
+        return audio_metadata(None, tags, None)
+    mime = audio.mime[0] if getattr(audio, "mime", None) else None
+    return audio_metadata(audio.info, audio.tags or {}, mime.split("/")[-1] if mime else None)
+
+def audio_metadata(info, tags, format):
+    year = first_tag(tags, "date", "originaldate", "year")
+    return {
+        "duration": int(round(info.length)) if getattr(info, "length", None) else None,
+        "bitRate": int(info.bitrate) if getattr(info, "bitrate", None) else None,
+        "sampleRate": int(info.sample_rate) if getattr(info, "sample_rate", None) else None,
+        "codec": getattr(info, "codec", None) or format,
+        "format": format,
+        "title": first_tag(tags, "title"),
+        "artist": first_tag(tags, "artist", "albumartist"),
+        "album": first_tag(tags, "album"),
+        "genre": first_tag(tags, "genre"),
+        "year": int(year[:4]) if year and year[:4].isdigit() else None,
+    }